@@ -9,17 +9,33 @@ dotenv.load_dotenv()
 # Add Supabase API Keys
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# JWT secret used to verify HS256 access tokens locally (Project Settings > API > JWT Settings)
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+
+# --- Supabase HTTP Connection Pool ---
+# A single pooled HTTP client is shared by the PostgREST and Auth clients so that
+# TCP/TLS connections to SUPABASE_URL are kept alive and reused across requests.
+# Keep max connections below the connection limit of your Supabase plan.
+SUPABASE_HTTP_MAX_CONNECTIONS = int(
+    os.getenv("SUPABASE_HTTP_MAX_CONNECTIONS", "20"))
+SUPABASE_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("SUPABASE_HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+# Idle connections are closed after this many seconds to avoid stale sockets.
+SUPABASE_HTTP_KEEPALIVE_EXPIRY = 30.0
+SUPABASE_HTTP_TIMEOUT = 10.0
+SUPABASE_HTTP_CONNECT_TIMEOUT = 2.0
 
 
 # --- Frontend CORS Origins ---
 # This list will be used for Cross-Origin Resource Sharing (CORS) configuration
 # It specifies which origins are allowed to make requests to this API.
-FRONTEND_CORS_ORIGINS = [
+# A frozenset, so matching the request's Origin header is a constant-time lookup.
+FRONTEND_CORS_ORIGINS = frozenset([
     "http://localhost:8080",
     "http://127.0.0.1:8080",
     "https://alldone-task-list.onrender.com",
     "http://127.0.0.1:5173",
     "http://localhost:5173",
     "https://alldone-task-list.vercel.app",
-]
+])
 
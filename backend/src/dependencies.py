@@ -3,27 +3,28 @@
 import logging
 from typing import Optional, Dict, Any
 
-from fastapi import Depends, HTTPException, status, WebSocket
+from fastapi import Depends, HTTPException, Request, status, WebSocket
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from src.services.supabase import SupabaseService
+from src.services.supabase import supabase_service
 # Make sure this import is correct
 from supabase_auth.errors import AuthApiError
 
 logger = logging.getLogger(__name__)
 
-# Re-use the singleton instance of the SupabaseService
-supabase_service = SupabaseService()
+# Shared Bearer scheme. It only declares the security scheme for OpenAPI and
+# never rejects requests itself; the token is validated by AuthMiddleware.
+_bearer_scheme = HTTPBearer(bearerFormat="JWT", auto_error=False)
 
 # Dependency for standard HTTP endpoints
 
 
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(
-        HTTPBearer(bearerFormat="JWT"))
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer_scheme)
 ) -> Dict[str, Any]:
     """
-    Validates the Bearer token and returns the authenticated user's data.
+    Returns the authenticated user's data resolved from the Bearer token by AuthMiddleware.
     Raises HTTPException 401 if the token is invalid or missing.
     """
     if not supabase_service.is_initialized:
@@ -32,13 +33,12 @@ async def get_current_user(
             detail="Authentication service is not available."
         )
 
-    token = credentials.credentials
-    user = await supabase_service.get_user_by_token(token)
+    user = getattr(request.state, "user", None)
 
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token.",
+            detail="Invalid or expired token." if credentials else "Not authenticated.",
             headers={"WWW-Authenticate": "Bearer"},
         )
     return user
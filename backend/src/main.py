@@ -1,29 +1,61 @@
 # project/src/main.py
 
+import hashlib
 import logging
 import re
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
 
-import uuid
-from datetime import datetime, timezone
-from fastapi import Body, FastAPI, HTTPException, WebSocket, status, Depends
-from fastapi.middleware.cors import CORSMiddleware
+import orjson
+from cachetools import TTLCache
+from fastapi import Body, FastAPI, HTTPException, Request, WebSocket, status, Depends
+from fastapi.responses import ORJSONResponse, Response
 from supabase_auth.errors import AuthApiError
 
 from src.config import FRONTEND_CORS_ORIGINS
 from src.utils.logging import setup_logging
-from src.services.supabase import SupabaseService
+from src.services.supabase import supabase_service
 from src.models.auth import UserCredentials, AuthResponse
 from src.models.task import Task, TaskCreate, TaskUpdate
 from src.dependencies import get_current_user, get_current_user_ws
+from src.middleware.auth import AuthMiddleware
+from src.middleware.cors import FastCORSMiddleware
 
 # --- Setup Logging ---
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# --- Initialize Global Services ---
-# SupabaseService manages database interactions.
-supabase_service = SupabaseService()
+# --- Global Services ---
+# `supabase_service` (from src.services.supabase) manages database interactions.
+
+# --- Tasks Cache ---
+# Short-lived, in-process cache of each user's serialized task list and its ETag,
+# keyed by user ID. Entries are invalidated whenever the user creates, updates or deletes a task.
+TASKS_CACHE_TTL_SECONDS = 5
+_tasks_cache: TTLCache = TTLCache(maxsize=10000, ttl=TASKS_CACHE_TTL_SECONDS)
+# Browsers keep the list but revalidate it with If-None-Match on every request.
+TASKS_CACHE_CONTROL = "private, no-cache"
+# Count of recent task writes per user. A read only caches the list it fetched if no
+# write happened meanwhile, so a list fetched before a write is never cached after it.
+# Entries only need to outlive one fetch, which the Supabase HTTP timeouts keep well
+# under a minute.
+TASKS_GENERATION_TTL_SECONDS = 60
+_tasks_generation: TTLCache = TTLCache(
+    maxsize=10000, ttl=TASKS_GENERATION_TTL_SECONDS)
+
+
+def _invalidate_tasks_cache(user_id: str):
+    """Drops the user's cached task list after a write, including any list still being fetched."""
+    _tasks_generation[user_id] = _tasks_generation.get(user_id, 0) + 1
+    _tasks_cache.pop(user_id, None)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Creates the async Supabase client on startup and releases its connections on shutdown."""
+    await supabase_service.initialize()
+    yield
+    await supabase_service.close()
 
 
 # --- FastAPI App Setup ---
@@ -32,17 +64,18 @@ app = FastAPI(
     # MODIFIED: Changed description
     description="API for the Alldone task list application.",
     version="1.0.0",
+    lifespan=lifespan,
+    # Render every JSON response with orjson instead of the stdlib json module.
+    default_response_class=ORJSONResponse,
 )
 
-# Configure CORS (Cross-Origin Resource Sharing)
+# Resolve the authenticated user once per request, before routing.
+# Added before CORS so that CORS stays the outermost middleware.
+app.add_middleware(AuthMiddleware, service=supabase_service)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=FRONTEND_CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Configure CORS (Cross-Origin Resource Sharing)
+# Preflight requests are answered by the middleware itself, before auth and routing.
+app.add_middleware(FastCORSMiddleware, origins=FRONTEND_CORS_ORIGINS)
 
 
 @app.get("/", summary="Health Check")
@@ -52,6 +85,19 @@ async def read_root():
     return {"message": "FastAPI is running!"}
 
 
+def _build_auth_response(auth_data: Dict[str, Any]) -> AuthResponse:
+    """Builds the AuthResponse for signup and login from the Supabase Auth user and session data."""
+    session = auth_data.get("session") or {}
+    return AuthResponse(
+        access_token=session.get("access_token"),
+        token_type=session.get("token_type", "Bearer"),
+        expires_in=session.get("expires_in"),
+        refresh_token=session.get("refresh_token"),
+        user=auth_data.get("user"),
+        session=session
+    )
+
+
 # Authentication Endpoints (unchanged logic)
 @app.post(
     "/auth/signup",
@@ -66,7 +112,7 @@ async def signup(credentials: UserCredentials):
     Registers a new user in Supabase.
     A confirmation email might be sent depending on Supabase project settings.
     """
-    logger.info(f"Attempting to sign up user: {credentials.email}")
+    logger.info("Attempting to sign up user: %s", credentials.email)
     if not supabase_service.is_initialized:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -74,15 +120,11 @@ async def signup(credentials: UserCredentials):
         )
     try:
         auth_data = await supabase_service.sign_up(credentials.email, credentials.password)
-        return AuthResponse(
-            access_token=auth_data.get("session", {}).get("access_token"),
-            token_type=auth_data.get("session", {}).get(
-                "token_type", "Bearer"),
-            expires_in=auth_data.get("session", {}).get("expires_in"),
-            refresh_token=auth_data.get("session", {}).get("refresh_token"),
-            user=auth_data.get("user"),
-            session=auth_data.get("session")
-        )
+        auth_response = _build_auth_response(auth_data)
+        # Serialize the already-validated model directly, instead of letting
+        # FastAPI validate it again against response_model.
+        return Response(auth_response.model_dump_json(), media_type="application/json",
+                        status_code=status.HTTP_201_CREATED)
     except AuthApiError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=e.message)
@@ -91,7 +133,7 @@ async def signup(credentials: UserCredentials):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     except Exception as e:
         logger.error(
-            f"Unhandled error during signup for {credentials.email}: {e}", exc_info=True)
+            "Unhandled error during signup for %s: %s", credentials.email, e, exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="An unexpected error occurred during signup.")
 
@@ -107,7 +149,7 @@ async def login(credentials: UserCredentials):
     """
     Logs in an existing user in Supabase.
     """
-    logger.info(f"Attempting to log in user: {credentials.email}")
+    logger.info("Attempting to log in user: %s", credentials.email)
     if not supabase_service.is_initialized:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -115,15 +157,10 @@ async def login(credentials: UserCredentials):
         )
     try:
         auth_data = await supabase_service.sign_in(credentials.email, credentials.password)
-        return AuthResponse(
-            access_token=auth_data.get("session", {}).get("access_token"),
-            token_type=auth_data.get("session", {}).get(
-                "token_type", "Bearer"),
-            expires_in=auth_data.get("session", {}).get("expires_in"),
-            refresh_token=auth_data.get("session", {}).get("refresh_token"),
-            user=auth_data.get("user"),
-            session=auth_data.get("session")
-        )
+        auth_response = _build_auth_response(auth_data)
+        # Serialize the already-validated model directly, instead of letting
+        # FastAPI validate it again against response_model.
+        return Response(auth_response.model_dump_json(), media_type="application/json")
     except AuthApiError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=e.message)
@@ -132,27 +169,44 @@ async def login(credentials: UserCredentials):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     except Exception as e:
         logger.error(
-            f"Unhandled error during login for {credentials.email}: {e}", exc_info=True)
+            "Unhandled error during login for %s: %s", credentials.email, e, exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="An unexpected error occurred during login.")
 
 
 @app.get("/tasks/", response_model=List[Task], tags=["Tasks"])
-async def read_tasks(current_user: Dict[str, Any] = Depends(get_current_user)):
+async def read_tasks(request: Request, current_user: Dict[str, Any] = Depends(get_current_user)):
     """
     Retrieve all tasks for the authenticated user.
+    Rows come straight from our schema-enforced table, so they are returned as-is
+    instead of being re-validated through the Task model; `response_model` is kept
+    for the OpenAPI schema. Responds 304 when the client's If-None-Match matches the list's ETag.
     """
     user_id = current_user.get("id")
     if not user_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User ID not found in token.")
 
-    response = supabase_service.client.table('tasks').select(
-        '*').eq('user_id', user_id).order('created_at', desc=False).execute()
-    if response.data is None:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail="Failed to fetch tasks from database.")
-    return [Task(**task_data) for task_data in response.data]
+    cached = _tasks_cache.get(user_id)
+    if cached is None:
+        generation = _tasks_generation.get(user_id, 0)
+        response = await supabase_service.client.table('tasks').select(
+            '*').eq('user_id', user_id).order('created_at', desc=False).execute()
+        if response.data is None:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                detail="Failed to fetch tasks from database.")
+        body = orjson.dumps(response.data)
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        cached = (body, etag)
+        if _tasks_generation.get(user_id, 0) == generation:
+            _tasks_cache[user_id] = cached
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": TASKS_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @app.post("/tasks/", response_model=Task, status_code=status.HTTP_201_CREATED, tags=["Tasks"])
@@ -165,21 +219,18 @@ async def create_task(task_create: TaskCreate, current_user: Dict[str, Any] = De
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User ID not found in token.")
 
-    new_task_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    # id, created_at and updated_at are set by the database column defaults
     task_data = {
-        "id": new_task_id,
         "user_id": user_id,
         "text": task_create.text,
         "completed": task_create.completed,
-        "created_at": now,
-        "updated_at": now
     }
-    response = supabase_service.client.table(
+    response = await supabase_service.client.table(
         'tasks').insert(task_data).execute()
     if response.data is None or not response.data:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Failed to create task in database.")
+    _invalidate_tasks_cache(user_id)
     return Task(**response.data[0])
 
 
@@ -193,22 +244,20 @@ async def update_task(task_id: str, task_update: TaskUpdate, current_user: Dict[
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User ID not found in token.")
 
-    now = datetime.now(timezone.utc).isoformat()
+    # updated_at is maintained by the tasks_set_updated_at database trigger
     update_data = task_update.model_dump(exclude_unset=True)
-    update_data["updated_at"] = now
+    if not update_data:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No fields to update.")
 
-    response = supabase_service.client.table('tasks').update(
+    response = await supabase_service.client.table('tasks').update(
         update_data).eq('id', task_id).eq('user_id', user_id).execute()
     if response.data is None or not response.data:
-        # Check if the task exists but belongs to another user
-        check_response = supabase_service.client.table(
-            'tasks').select('id').eq('id', task_id).execute()
-        if not check_response.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Task not found.")
-        else:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail="Not authorized to update this task.")
+        # No row matched both the task ID and the user. Tasks owned by other users
+        # are reported as not found too, so their existence is never revealed.
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Task not found.")
+    _invalidate_tasks_cache(user_id)
     return Task(**response.data[0])
 
 
@@ -222,22 +271,16 @@ async def delete_task(task_id: str, current_user: Dict[str, Any] = Depends(get_c
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="User ID not found in token.")
 
-    response = supabase_service.client.table('tasks').delete().eq(
+    response = await supabase_service.client.table('tasks').delete().eq(
         'id', task_id).eq('user_id', user_id).execute()
 
     # Supabase `delete` often returns data=[] if no rows matched, or data with deleted rows if matched.
     # If no data is returned or the data list is empty, it means no task was deleted by this user.
     if not response.data:  # Check for empty list or None
-        # Now, check if the task exists at all to differentiate 404 from 403
-        check_response = supabase_service.client.table(
-            'tasks').select('id').eq('id', task_id).execute()
-        if not check_response.data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Task not found.")
-        else:
-            # Task exists but user_id didn't match (i.e., belongs to another user)
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail="Not authorized to delete this task.")
+        # Tasks owned by other users are reported as not found too, so their existence is never revealed.
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Task not found.")
     # If `response.data` is not empty, a task was successfully deleted.
+    _invalidate_tasks_cache(user_id)
     # FastAPI will return 204 No Content due to the decorator.
     return
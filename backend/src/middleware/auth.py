@@ -0,0 +1,43 @@
+# project/src/middleware/auth.py
+
+import logging
+from typing import Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.services.supabase import SupabaseService
+
+logger = logging.getLogger(__name__)
+
+_BEARER_PREFIX = b"bearer "
+
+
+def _get_bearer_token(scope: Scope) -> Optional[str]:
+    """Extracts the Bearer token from the raw ASGI headers, if present."""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            if value[:len(_BEARER_PREFIX)].lower() != _BEARER_PREFIX:
+                return None
+            token = value[len(_BEARER_PREFIX):].strip()
+            return token.decode("latin-1") if token else None
+    return None
+
+
+class AuthMiddleware:
+    """
+    Pure ASGI middleware that authenticates HTTP requests carrying a Bearer token.
+    The resolved user (or None) is stored in `scope["state"]["user"]`, where the
+    `get_current_user` dependency reads it back as `request.state.user`.
+    """
+
+    def __init__(self, app: ASGIApp, service: SupabaseService):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and self.service.is_initialized:
+            token = _get_bearer_token(scope)
+            if token:
+                user = await self.service.get_user_by_token(token)
+                scope.setdefault("state", {})["user"] = user
+        await self.app(scope, receive, send)
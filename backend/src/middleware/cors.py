@@ -0,0 +1,85 @@
+# project/src/middleware/cors.py
+
+from typing import Iterable, List, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ALLOWED_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+PREFLIGHT_MAX_AGE = b"600"
+
+
+class FastCORSMiddleware:
+    """
+    Pure ASGI CORS middleware for a fixed set of origins, allowing credentials and
+    any method or header. Origins are matched with a frozenset lookup, and preflight
+    requests are answered directly without reaching the rest of the application.
+    """
+
+    def __init__(self, app: ASGIApp, origins: Iterable[str]):
+        self.app = app
+        self.origins = frozenset(origin.encode("latin-1") for origin in origins)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight_response(origin, request_headers, send)
+            return
+
+        if origin not in self.origins:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cors_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("access-control-allow-origin",
+                               origin.decode("latin-1"))
+                headers.append("access-control-allow-credentials", "true")
+                headers.add_vary_header("Origin")
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors_headers)
+
+    async def _preflight_response(self, origin: bytes, request_headers: Optional[bytes], send: Send) -> None:
+        if origin in self.origins:
+            status = 200
+            body = b"OK"
+            headers: List[Tuple[bytes, bytes]] = [
+                (b"access-control-allow-origin", origin),
+                (b"access-control-allow-credentials", b"true"),
+                (b"access-control-allow-methods", ALLOWED_METHODS),
+                (b"access-control-max-age", PREFLIGHT_MAX_AGE),
+            ]
+            if request_headers:
+                headers.append(
+                    (b"access-control-allow-headers", request_headers))
+        else:
+            status = 400
+            body = b"Disallowed CORS origin"
+            headers = []
+        headers += [
+            (b"vary", b"Origin"),
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -1,32 +1,97 @@
 # project/src/services/supabase.py
 
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, Optional, Tuple
 
-from supabase import create_client, Client
+import httpx
+import jwt
+from cachetools import TLRUCache
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
 from supabase_auth.errors import AuthApiError
 
-from src.config import SUPABASE_URL, SUPABASE_KEY
+from src.config import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    SUPABASE_JWT_SECRET,
+    SUPABASE_HTTP_MAX_CONNECTIONS,
+    SUPABASE_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    SUPABASE_HTTP_KEEPALIVE_EXPIRY,
+    SUPABASE_HTTP_TIMEOUT,
+    SUPABASE_HTTP_CONNECT_TIMEOUT,
+)
 
 logger = logging.getLogger(__name__)
 
+# --- Token Validation Cache ---
+# Successful token validations are cached for a short time, keyed by the SHA-256
+# digest of the raw JWT, so repeat requests skip the round-trip to Supabase Auth.
+TOKEN_CACHE_TTL_SECONDS = 30
+TOKEN_CACHE_MAXSIZE = 10000
+
+
+def _token_cache_ttu(key: bytes, value: Tuple[Dict[str, Any], float], now: float) -> float:
+    """Expires each entry after the TTL stored alongside the cached user data."""
+    return now + value[1]
+
+
+_token_cache: TLRUCache = TLRUCache(
+    maxsize=TOKEN_CACHE_MAXSIZE, ttu=_token_cache_ttu)
+# Validations currently in progress, so concurrent requests with the same new
+# token share a single call to Supabase Auth instead of each making their own.
+_token_inflight: Dict[bytes, "asyncio.Task[Optional[Dict[str, Any]]]"] = {}
+
+# --- Local JWT Verification ---
+# Audience Supabase Auth issues access tokens for.
+JWT_AUDIENCE = "authenticated"
+# Signing algorithms verified against the project's JWKS endpoint.
+JWKS_ALGORITHMS = ("RS256", "ES256")
+# Seconds allowed for fetching the JWKS, so a slow endpoint cannot stall requests.
+JWKS_FETCH_TIMEOUT_SECONDS = 5
+# Minimum seconds between JWKS fetches. Tokens with an unknown `kid` would otherwise
+# trigger a fetch on every request.
+JWKS_REFRESH_MIN_INTERVAL_SECONDS = 300
+# Signing keys by `kid`, fetched from the project's JWKS endpoint and kept for the process lifetime.
+_jwks_keys: Dict[str, jwt.PyJWK] = {}
+_jwks_fetched_at: Optional[float] = None
+
+
+class LocalVerificationUnavailable(Exception):
+    """Raised when a token cannot be verified locally with the current configuration."""
+
+
+def _token_cache_ttl(token: str) -> float:
+    """
+    Returns how long a validated token may be cached: the default TTL, capped by
+    the time remaining until the token's `exp` claim.
+    """
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        return TOKEN_CACHE_TTL_SECONDS
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)):
+        return TOKEN_CACHE_TTL_SECONDS
+    return min(TOKEN_CACHE_TTL_SECONDS, exp - time.time())
+
 
 class SupabaseService:
     """
     Service for interacting with Supabase, primarily for authentication.
-    Designed as a singleton to maintain a single Supabase client instance.
+    The application shares the single module-level `supabase_service` instance.
     """
-    _instance: Optional['SupabaseService'] = None
-    _supabase_client: Optional[Client] = None
 
-    def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(SupabaseService, cls).__new__(cls)
-            cls._instance._initialize_supabase()
-        return cls._instance
+    def __init__(self):
+        self._supabase_client: Optional[AsyncClient] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
 
-    def _initialize_supabase(self):
-        """Initializes the Supabase client if not already done."""
+    async def initialize(self):
+        """
+        Initializes the async Supabase client if not already done.
+        Called once from the application's lifespan handler on startup.
+        """
         if not self._supabase_client:
             if not SUPABASE_URL or not SUPABASE_KEY:
                 logger.error(
@@ -37,14 +102,42 @@ class SupabaseService:
                 return
 
             try:
-                self._supabase_client = create_client(
-                    SUPABASE_URL, SUPABASE_KEY)
+                self._http_client = self._create_http_client()
+                self._supabase_client = await acreate_client(
+                    SUPABASE_URL,
+                    SUPABASE_KEY,
+                    options=AsyncClientOptions(httpx_client=self._http_client),
+                )
                 logger.info("Supabase client initialized successfully.")
             except Exception as e:
                 logger.error(
-                    f"Failed to initialize Supabase client. Error: {e}", exc_info=True
+                    "Failed to initialize Supabase client. Error: %s", e, exc_info=True
                 )
-                self._supabase_client = None
+                await self.close()
+
+    @staticmethod
+    def _create_http_client() -> httpx.AsyncClient:
+        """
+        Creates the pooled HTTP client shared by the PostgREST and Auth clients.
+        HTTP/2 lets concurrent requests share one TLS connection (requires the `h2` package).
+        """
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=SUPABASE_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                SUPABASE_HTTP_TIMEOUT, connect=SUPABASE_HTTP_CONNECT_TIMEOUT),
+        )
+
+    async def close(self):
+        """Closes the pooled HTTP client. Called from the application's lifespan handler on shutdown."""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        self._supabase_client = None
 
     @property
     def is_initialized(self) -> bool:
@@ -52,7 +145,7 @@ class SupabaseService:
         return self._supabase_client is not None
 
     @property
-    def client(self) -> Client:
+    def client(self) -> AsyncClient:
         """Returns the Supabase client instance, raising an error if not initialized."""
         if not self.is_initialized:
             raise RuntimeError("Supabase client is not initialized.")
@@ -79,24 +172,24 @@ class SupabaseService:
         try:
             # Supabase sign_up by default sends a confirmation email.
             # You can disable this in your Supabase project settings if needed for local testing.
-            response = self.client.auth.sign_up(
+            response = await self.client.auth.sign_up(
                 {
                     "email": email,
                     "password": password
                 }
             )
-            logger.info(f"User {email} successfully attempted to sign up.")
+            logger.info("User %s successfully attempted to sign up.", email)
             # The response from sign_up may or may not contain a session, depending on
             # your Supabase "Email Confirmation" setting.
             # If email confirmation is required, `session` will be None until confirmed.
             return response.model_dump()  # For pydantic v2. Use .dict() for pydantic v1
         except AuthApiError as e:
             logger.warning(
-                f"Supabase Auth error during sign-up for {email}: {e.message}")
+                "Supabase Auth error during sign-up for %s: %s", email, e.message)
             raise e
         except Exception as e:
             logger.error(
-                f"Unexpected error during sign-up for {email}: {e}", exc_info=True)
+                "Unexpected error during sign-up for %s: %s", email, e, exc_info=True)
             raise e
 
     async def sign_in(self, email: str, password: str) -> Dict[str, Any]:
@@ -118,27 +211,27 @@ class SupabaseService:
         if not self.is_initialized:
             raise RuntimeError("Supabase client is not initialized.")
         try:
-            response = self.client.auth.sign_in_with_password(
+            response = await self.client.auth.sign_in_with_password(
                 {
                     "email": email,
                     "password": password
                 }
             )
-            logger.info(f"User {email} successfully signed in.")
+            logger.info("User %s successfully signed in.", email)
             return response.model_dump()  # For pydantic v2. Use .dict() for pydantic v1
         except AuthApiError as e:
             logger.warning(
-                f"Supabase Auth error during sign-in for {email}: {e.message}")
+                "Supabase Auth error during sign-in for %s: %s", email, e.message)
             raise e
         except Exception as e:
             logger.error(
-                f"Unexpected error during sign-in for {email}: {e}", exc_info=True)
+                "Unexpected error during sign-in for %s: %s", email, e, exc_info=True)
             raise e
 
-    # THIS IS THE METHOD THAT WAS LIKELY MISSING OR MALFORMED
     async def get_user_by_token(self, token: str) -> Optional[Dict[str, Any]]:
         """
         Validates a JWT and retrieves the user data.
+        Successful validations are cached for a short time; failures are never cached.
 
         Args:
             token (str): The JWT access token.
@@ -149,16 +242,147 @@ class SupabaseService:
         if not self.is_initialized:
             raise RuntimeError("Supabase client is not initialized.")
 
+        key = hashlib.sha256(token.encode()).digest()
+        cached = _token_cache.get(key)
+        if cached is not None:
+            return cached[0]
+
+        # Share one validation task per token. Each caller awaits it through a shield,
+        # so a cancelled request never cancels the validation other requests wait on.
+        pending = _token_inflight.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._validate_and_cache(key, token))
+            _token_inflight[key] = pending
+            pending.add_done_callback(lambda _: _token_inflight.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _validate_and_cache(self, key: bytes, token: str) -> Optional[Dict[str, Any]]:
+        """Validates a token and caches the user data if it is valid."""
+        user = await self._validate_token(token)
+        if user is not None:
+            ttl = _token_cache_ttl(token)
+            if ttl > 0:
+                _token_cache[key] = (user, ttl)
+        return user
+
+    async def verify_jwt_local(self, token: str) -> Dict[str, Any]:
+        """
+        Verifies a JWT locally and builds the user data from its claims.
+        HS256 tokens are checked against SUPABASE_JWT_SECRET; asymmetric tokens
+        against the signing keys published at the project's JWKS endpoint.
+
+        Args:
+            token (str): The JWT access token.
+
+        Returns:
+            Dict[str, Any]: The user's data, shaped like the Supabase Auth user.
+
+        Raises:
+            jwt.InvalidTokenError: If the token is malformed, expired or has a bad signature.
+            LocalVerificationUnavailable: If the key needed to verify the token is not configured.
+        """
+        header = jwt.get_unverified_header(token)
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not SUPABASE_JWT_SECRET:
+                raise LocalVerificationUnavailable(
+                    "SUPABASE_JWT_SECRET is not configured.")
+            key = SUPABASE_JWT_SECRET
+        elif algorithm in JWKS_ALGORITHMS:
+            key = (await self._get_signing_key(header.get("kid"))).key
+        else:
+            raise jwt.InvalidAlgorithmError(
+                f"Unsupported token algorithm: {algorithm}")
+
+        payload = jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=JWT_AUDIENCE,
+            options={"require": ["exp", "sub"]},
+        )
+        return {
+            "id": payload["sub"],
+            "aud": payload.get("aud"),
+            "role": payload.get("role"),
+            "email": payload.get("email"),
+            "phone": payload.get("phone"),
+            "app_metadata": payload.get("app_metadata", {}),
+            "user_metadata": payload.get("user_metadata", {}),
+            "is_anonymous": payload.get("is_anonymous", False),
+        }
+
+    async def _get_signing_key(self, kid: Optional[str]) -> jwt.PyJWK:
+        """
+        Returns the JWKS signing key with the given `kid`, refetching the key set
+        when the key is unknown and the last fetch is old enough.
+
+        Raises:
+            LocalVerificationUnavailable: If no signing key with this `kid` is known.
+        """
+        key = _jwks_keys.get(kid)
+        if key is None and (
+            _jwks_fetched_at is None
+            or time.monotonic() - _jwks_fetched_at >= JWKS_REFRESH_MIN_INTERVAL_SECONDS
+        ):
+            await self._refresh_jwks()
+            key = _jwks_keys.get(kid)
+        if key is None:
+            raise LocalVerificationUnavailable(f"Unknown signing key: {kid}")
+        return key
+
+    async def _refresh_jwks(self):
+        """Fetches the project's JWKS through the pooled HTTP client and replaces the cached keys."""
+        global _jwks_keys, _jwks_fetched_at
+        if not SUPABASE_URL or self._http_client is None:
+            raise LocalVerificationUnavailable("The JWKS endpoint is not available.")
+        # Record the attempt first, so a failing endpoint is also rate limited.
+        _jwks_fetched_at = time.monotonic()
+        response = await self._http_client.get(
+            f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json",
+            timeout=JWKS_FETCH_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+        jwk_set = jwt.PyJWKSet.from_dict(response.json())
+        _jwks_keys = {jwk.key_id: jwk for jwk in jwk_set.keys if jwk.key_id}
+
+    async def _validate_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Validates a JWT and retrieves the user data.
+        Tokens are verified locally when possible; Supabase Auth is only asked
+        when local verification is unavailable or fails unexpectedly.
+
+        Args:
+            token (str): The JWT access token.
+
+        Returns:
+            Optional[Dict[str, Any]]: The user's data if the token is valid, otherwise None.
+        """
+        try:
+            return await self.verify_jwt_local(token)
+        except jwt.InvalidTokenError as e:
+            logger.warning("Token validation failed: %s", e)
+            return None
+        except LocalVerificationUnavailable as e:
+            logger.debug("Local token verification unavailable: %s", e)
+        except Exception as e:
+            logger.warning(
+                "Local token verification failed, falling back to Supabase Auth: %s", e)
+
         try:
             # The get_user method in supabase-py validates the token and returns the user
-            response = self.client.auth.get_user(token)
+            response = await self.client.auth.get_user(token)
             logger.info(
-                f"Successfully validated token for user: {response.user.email}")
+                "Successfully validated token for user: %s", response.user.email)
             return response.user.model_dump()  # Return user data as a dict
         except AuthApiError as e:
-            logger.warning(f"Token validation failed: {e.message}")
+            logger.warning("Token validation failed: %s", e.message)
             return None
         except Exception as e:
             logger.error(
-                f"Unexpected error during token validation: {e}", exc_info=True)
+                "Unexpected error during token validation: %s", e, exc_info=True)
             return None
+
+
+# Shared instance used by the application; initialized from the app's lifespan handler.
+supabase_service = SupabaseService()
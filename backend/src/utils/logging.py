@@ -9,6 +9,10 @@ def setup_logging():
     Sets the basic logging level and specifically tunes down verbose libraries.
     """
     logging.basicConfig(level=logging.INFO)
+    # Skip collecting thread and process details that no formatter here uses
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
     # Get the root logger
     root_logger = logging.getLogger()
     # Ensure all handlers log INFO or higher by default unless overridden
@@ -0,0 +1,96 @@
+# project/backend/tests/unit/test_auth_middleware.py
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+
+from src.middleware.auth import AuthMiddleware
+
+
+@pytest.fixture
+def mock_service():
+    """Mocks an initialized SupabaseService for the middleware."""
+    service = MagicMock()
+    service.is_initialized = True
+    service.get_user_by_token = AsyncMock()
+    return service
+
+
+@pytest.fixture
+def mock_app():
+    """Mocks the downstream ASGI application."""
+    return AsyncMock()
+
+
+def make_scope(headers=None, scope_type="http"):
+    return {"type": scope_type, "headers": headers or []}
+
+
+@pytest.mark.asyncio
+async def test_auth_middleware_sets_user_from_bearer_token(mock_service, mock_app):
+    """
+    Given a request with a Bearer token,
+    When it passes through AuthMiddleware,
+    Then the resolved user should be stored in the scope state.
+    """
+    test_user_data = {"id": "test_user_id", "email": "test@example.com"}
+    mock_service.get_user_by_token.return_value = test_user_data
+    scope = make_scope([(b"authorization", b"Bearer valid_jwt_token")])
+
+    await AuthMiddleware(mock_app, service=mock_service)(scope, None, None)
+
+    mock_service.get_user_by_token.assert_awaited_once_with("valid_jwt_token")
+    assert scope["state"]["user"] == test_user_data
+    mock_app.assert_awaited_once_with(scope, None, None)
+
+
+@pytest.mark.asyncio
+async def test_auth_middleware_invalid_token(mock_service, mock_app):
+    """
+    Given a request with an invalid Bearer token,
+    When it passes through AuthMiddleware,
+    Then the scope state user should be None.
+    """
+    mock_service.get_user_by_token.return_value = None
+    scope = make_scope([(b"authorization", b"bearer invalid_jwt_token")])
+
+    await AuthMiddleware(mock_app, service=mock_service)(scope, None, None)
+
+    mock_service.get_user_by_token.assert_awaited_once_with("invalid_jwt_token")
+    assert scope["state"]["user"] is None
+    mock_app.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("headers", [
+    [],
+    [(b"authorization", b"Basic dXNlcjpwYXNz")],
+    [(b"authorization", b"Bearer ")],
+])
+async def test_auth_middleware_without_bearer_token(mock_service, mock_app, headers):
+    """
+    Given a request without a usable Bearer token,
+    When it passes through AuthMiddleware,
+    Then no token validation should happen.
+    """
+    scope = make_scope(headers)
+
+    await AuthMiddleware(mock_app, service=mock_service)(scope, None, None)
+
+    mock_service.get_user_by_token.assert_not_awaited()
+    assert "state" not in scope
+    mock_app.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_auth_middleware_ignores_non_http_scopes(mock_service, mock_app):
+    """
+    Given a WebSocket connection,
+    When it passes through AuthMiddleware,
+    Then it should be forwarded untouched.
+    """
+    scope = make_scope(
+        [(b"authorization", b"Bearer valid_jwt_token")], scope_type="websocket")
+
+    await AuthMiddleware(mock_app, service=mock_service)(scope, None, None)
+
+    mock_service.get_user_by_token.assert_not_awaited()
+    mock_app.assert_awaited_once_with(scope, None, None)
@@ -0,0 +1,94 @@
+# project/backend/tests/unit/test_cors_middleware.py
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import Mock
+
+from src.middleware.cors import FastCORSMiddleware
+
+ALLOWED_ORIGIN = "http://localhost:5173"
+
+
+@pytest.fixture
+def downstream():
+    """Records the requests that reach the endpoint behind the middleware."""
+    return Mock()
+
+
+@pytest.fixture
+def client(downstream):
+    """TestClient for an app with a single endpoint behind FastCORSMiddleware."""
+    cors_app = FastAPI()
+    cors_app.add_middleware(FastCORSMiddleware, origins=[ALLOWED_ORIGIN])
+
+    @cors_app.api_route("/", methods=["GET", "OPTIONS"])
+    async def endpoint():
+        downstream()
+        return {"ok": True}
+
+    with TestClient(cors_app) as test_client:
+        yield test_client
+
+
+def test_preflight_allowed_origin_short_circuits(client: TestClient, downstream: Mock):
+    """
+    Given a preflight request from an allowed origin,
+    When it reaches FastCORSMiddleware,
+    Then it should be answered directly with the CORS headers.
+    """
+    response = client.options("/", headers={
+        "Origin": ALLOWED_ORIGIN,
+        "Access-Control-Request-Method": "PUT",
+        "Access-Control-Request-Headers": "authorization,content-type",
+    })
+
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == ALLOWED_ORIGIN
+    assert response.headers["access-control-allow-credentials"] == "true"
+    assert "PUT" in response.headers["access-control-allow-methods"]
+    assert response.headers["access-control-allow-headers"] == "authorization,content-type"
+    downstream.assert_not_called()
+
+
+def test_preflight_disallowed_origin(client: TestClient, downstream: Mock):
+    """
+    Given a preflight request from an unknown origin,
+    When it reaches FastCORSMiddleware,
+    Then it should be rejected with 400 and no CORS headers.
+    """
+    response = client.options("/", headers={
+        "Origin": "https://evil.example.com",
+        "Access-Control-Request-Method": "GET",
+    })
+
+    assert response.status_code == 400
+    assert "access-control-allow-origin" not in response.headers
+    downstream.assert_not_called()
+
+
+def test_simple_request_allowed_origin_gets_cors_headers(client: TestClient, downstream: Mock):
+    """
+    Given a regular request from an allowed origin,
+    When it passes through FastCORSMiddleware,
+    Then the response should carry the CORS headers.
+    """
+    response = client.get("/", headers={"Origin": ALLOWED_ORIGIN})
+
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == ALLOWED_ORIGIN
+    assert response.headers["access-control-allow-credentials"] == "true"
+    assert response.headers["vary"] == "Origin"
+    downstream.assert_called_once()
+
+
+def test_simple_request_disallowed_origin_has_no_cors_headers(client: TestClient, downstream: Mock):
+    """
+    Given a regular request from an unknown origin,
+    When it passes through FastCORSMiddleware,
+    Then the response should not carry CORS headers.
+    """
+    response = client.get("/", headers={"Origin": "https://evil.example.com"})
+
+    assert response.status_code == 200
+    assert "access-control-allow-origin" not in response.headers
+    downstream.assert_called_once()
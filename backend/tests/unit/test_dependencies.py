@@ -1,52 +1,55 @@
 # project/backend/tests/unit/test_dependencies.py
 import pytest
-from fastapi import HTTPException, status, WebSocket
+from contextlib import ExitStack
+from fastapi import HTTPException, Request, status, WebSocket
 from fastapi.security import HTTPAuthorizationCredentials
-from unittest.mock import MagicMock, AsyncMock, patch
+from unittest.mock import Mock, MagicMock, AsyncMock, patch
 
 from src.dependencies import get_current_user, get_current_user_ws, supabase_service
 
+# get_current_user only checks whether credentials were sent; the token itself was
+# already validated (or rejected) by AuthMiddleware, so one instance serves every test.
+BEARER_CREDENTIALS = HTTPAuthorizationCredentials(
+    scheme="Bearer", credentials="jwt_token")
 
-# Fixture to reset the supabase_service singleton for each test
-@pytest.fixture(autouse=True)
-def reset_supabase_service_singleton():
-    """Resets the SupabaseService singleton before each test."""
-    supabase_service._instance = None
-    supabase_service._supabase_client = None
 
 # Mock SupabaseService to control its state and return values
 
 
 @pytest.fixture
-def mock_supabase_service(mocker):
-    """Mocks the SupabaseService instance used by dependencies."""
-    # Ensure the singleton is initialized (mocked) for the test
-    service = supabase_service  # Access the singleton instance
-    # Mock the internal supabase client. This makes `service.is_initialized` return True.
-    service._supabase_client = MagicMock()
-    service.get_user_by_token = AsyncMock()
-    return service
+def mock_supabase_service():
+    """
+    Mocks the SupabaseService instance used by dependencies.
+    The patches are undone after each test, so the shared instance needs no separate reset.
+    """
+    service = supabase_service  # Access the shared instance
+    with ExitStack() as patches:
+        # Mock the internal supabase client. This makes `service.is_initialized` return True.
+        patches.enter_context(patch.object(
+            service, '_supabase_client', new=Mock()))
+        patches.enter_context(patch.object(
+            service, 'get_user_by_token', new=AsyncMock()))
+        yield service
 
 # Test cases for get_current_user
 
 
+def make_request(state: dict) -> Request:
+    """Builds a bare HTTP request whose state is what AuthMiddleware would have set."""
+    return Request({"type": "http", "headers": [], "state": state})
+
+
 @pytest.mark.asyncio
 async def test_get_current_user_success(mock_supabase_service):
     """
-    Given a valid JWT token,
+    Given a request already authenticated by AuthMiddleware,
     When get_current_user is called,
-    Then it should return the user data.
+    Then it should return the user data without validating the token again.
     """
-    test_token = "valid_jwt_token"
     test_user_data = {"id": "test_user_id", "email": "test@example.com"}
-    mock_supabase_service.get_user_by_token.return_value = test_user_data
-    credentials = HTTPAuthorizationCredentials(
-        scheme="Bearer", credentials=test_token)
-
-    user = await get_current_user(credentials)
+    user = await get_current_user(make_request({"user": test_user_data}), BEARER_CREDENTIALS)
 
-    mock_supabase_service.get_user_by_token.assert_awaited_once_with(
-        test_token)
+    mock_supabase_service.get_user_by_token.assert_not_awaited()
     assert user == test_user_data
 
 
@@ -57,18 +60,25 @@ async def test_get_current_user_invalid_token(mock_supabase_service):
     When get_current_user is called,
     Then it should raise HTTPException 401.
     """
-    test_token = "invalid_jwt_token"
-    mock_supabase_service.get_user_by_token.return_value = None
-    credentials = HTTPAuthorizationCredentials(
-        scheme="Bearer", credentials=test_token)
-
     with pytest.raises(HTTPException) as exc_info:
-        await get_current_user(credentials)
+        await get_current_user(make_request({"user": None}), BEARER_CREDENTIALS)
 
     assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert exc_info.value.detail == "Invalid or expired token."
-    mock_supabase_service.get_user_by_token.assert_awaited_once_with(
-        test_token)
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_missing_token(mock_supabase_service):
+    """
+    Given a request without a Bearer token,
+    When get_current_user is called,
+    Then it should raise HTTPException 401.
+    """
+    with pytest.raises(HTTPException) as exc_info:
+        await get_current_user(make_request({}), None)
+
+    assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert exc_info.value.detail == "Not authenticated."
 
 
 @pytest.mark.asyncio
@@ -80,11 +90,8 @@ async def test_get_current_user_service_unavailable(mock_supabase_service):
     """
     # To simulate service unavailable, set the internal client to None
     mock_supabase_service._supabase_client = None
-    credentials = HTTPAuthorizationCredentials(
-        scheme="Bearer", credentials="any_token")
-
     with pytest.raises(HTTPException) as exc_info:
-        await get_current_user(credentials)
+        await get_current_user(make_request({}), BEARER_CREDENTIALS)
 
     assert exc_info.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
     assert exc_info.value.detail == "Authentication service is not available."
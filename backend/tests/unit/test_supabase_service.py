@@ -1,21 +1,56 @@
 # project/backend/tests/unit/test_supabase_service.py
+import asyncio
+import time
+
+import httpx
+import jwt
+import orjson
 import pytest
-from unittest.mock import MagicMock, patch, AsyncMock
-from supabase import Client
+import pytest_asyncio
+from cryptography.hazmat.primitives.asymmetric import ec
+from jwt.algorithms import ECAlgorithm
+from unittest.mock import Mock, patch, AsyncMock
 from supabase_auth.errors import AuthApiError
 
-from src.services.supabase import SupabaseService
-import src.config  # Import config for direct patching
+from src.services.supabase import TOKEN_CACHE_TTL_SECONDS, SupabaseService, _token_cache, _token_cache_ttl
+
+TEST_JWT_SECRET = "test_jwt_secret_with_at_least_32_bytes"
+
+
+def make_token(sub: str = "user123", secret: str = "unknown_secret_with_at_least_32_bytes", **claims) -> str:
+    """Builds an HS256 access token shaped like the ones Supabase Auth issues."""
+    payload = {"sub": sub, "aud": "authenticated", "role": "authenticated",
+               "email": "test@example.com", "exp": int(time.time()) + 3600}
+    payload.update(claims)
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+VALID_JWT = make_token()
+INVALID_JWT = make_token(sub="invalid")
+SOME_JWT = make_token(sub="some")
+
+CREDENTIALS = {"email": "test@example.com", "password": "password123"}
+USER_PAYLOAD = {"id": "user123", "email": "test@example.com"}
+AUTH_PAYLOAD = {
+    "user": USER_PAYLOAD,
+    "session": {"access_token": "abc", "token_type": "Bearer", "expires_in": 3600, "refresh_token": "def"}
+}
+
+DUPLICATE_USER_ERROR = AuthApiError(message="Duplicate user", status=400, code="400")
+INVALID_CREDENTIALS_ERROR = AuthApiError(
+    message="Invalid credentials", status=400, code="400")
+INVALID_JWT_ERROR = AuthApiError(message="Invalid JWT", status=401, code="401")
 
 
 # Fixture to mock `create_client` for initialization tests.
 @pytest.fixture
 def mock_create_client_only(mocker):
     """
-    Mocks the `create_client` function that SupabaseService's _initialize_supabase calls.
+    Mocks the `acreate_client` function that SupabaseService's initialize calls.
     """
-    mock_client_factory = mocker.patch('src.services.supabase.create_client')
-    mock_client_instance = MagicMock(spec=Client)
+    mock_client_factory = mocker.patch(
+        'src.services.supabase.acreate_client', new_callable=AsyncMock)
+    mock_client_instance = Mock()
     mock_client_factory.return_value = mock_client_instance
     yield mock_client_factory, mock_client_instance
 
@@ -31,12 +66,13 @@ async def test_supabase_service_initialization_failure(mock_create_client_only):
     """
     mock_create_client_factory, _ = mock_create_client_only
 
-    # Force an exception when create_client is called by _initialize_supabase
+    # Force an exception when acreate_client is called by initialize
     mock_create_client_factory.side_effect = Exception(
         "Simulated connection error")
 
     # Act
-    service = SupabaseService()  # This call attempts to initialize
+    service = SupabaseService()
+    await service.initialize()
 
     # Assert
     assert not service.is_initialized
@@ -46,120 +82,260 @@ async def test_supabase_service_initialization_failure(mock_create_client_only):
         _ = service.client
 
 
-# Fixture for testing SupabaseService methods (sign_up, sign_in, etc.)
-# This fixture needs `mocker` because it's function-scoped and performs patching.
-@pytest.fixture
-def mock_supabase_service_for_methods(mocker):  # Add mocker to parameters
+@pytest.mark.asyncio
+async def test_supabase_service_uses_pooled_http_client(mock_create_client_only, mocker):
     """
-    Mocks the SupabaseService instance for method-level tests (sign_up, sign_in, get_user_by_token).
-    Ensures the service is initialized with a mock client, and its auth methods are properly mocked.
+    Given the Supabase client is created successfully,
+    When SupabaseService is initialized and then closed,
+    Then the client should share the service's pooled HTTP client, and closing
+    should release it and reset the service.
     """
-    # Ensure a fresh singleton for each test
-    SupabaseService._instance = None
-    SupabaseService._supabase_client = None
-
-    # Temporarily patch src.config values to ensure initialization can happen
-    # This is important in case `SupabaseService()` is called and initializes `_supabase_client`
-    # before its methods are patched. These patches are handled by 'mocker' and are function-scoped.
-    mocker.patch.object(src.config, 'SUPABASE_URL', "http://test_supabase.url")
-    mocker.patch.object(src.config, 'SUPABASE_KEY', "test_supabase_key")
+    mock_create_client_factory, mock_client_instance = mock_create_client_only
 
     service = SupabaseService()
-    # The above call to `SupabaseService()` will trigger `_initialize_supabase` using the
-    # `src.config` values (either from global conftest mock or the local mocker patches here).
-    # Then we override `_supabase_client` with our specific `MagicMock` for precise control.
-    service._supabase_client = MagicMock(spec=Client)
+    await service.initialize()
+
+    http_client = service._http_client
+    assert isinstance(http_client, httpx.AsyncClient)
+    assert service.client is mock_client_instance
+    options = mock_create_client_factory.call_args.kwargs["options"]
+    assert options.httpx_client is http_client
+
+    aclose = mocker.patch.object(http_client, "aclose", new_callable=AsyncMock)
+    await service.close()
+
+    aclose.assert_awaited_once()
+    assert service._http_client is None
+    assert not service.is_initialized
+
 
-    # Mock the auth object and its methods.
-    mock_auth = MagicMock()
+# Fixture for testing SupabaseService methods (sign_up, sign_in, etc.)
+# Built once per module; `reset_service_method_mocks` clears what each test configured.
+@pytest.fixture(scope="module")
+def mock_supabase_service_for_methods():
+    """
+    Mocks the SupabaseService instance for method-level tests (sign_up, sign_in, get_user_by_token).
+    Ensures the service is initialized with a mock client, and its auth methods are properly mocked.
+    """
+    # Mock the auth object and its methods. The async client's auth methods are awaited.
+    mock_auth = Mock()
+    mock_auth.sign_up = AsyncMock()
+    mock_auth.sign_in_with_password = AsyncMock()
+    mock_auth.get_user = AsyncMock()
 
-    mock_auth_response_for_service = MagicMock()
-    mock_auth_response_for_service.model_dump.return_value = {
-        "user": {"id": "user123", "email": "test@example.com"},
-        "session": {"access_token": "abc", "token_type": "Bearer", "expires_in": 3600, "refresh_token": "def"}
-    }
+    mock_auth_response_for_service = Mock()
+    mock_auth_response_for_service.model_dump.return_value = AUTH_PAYLOAD
 
     mock_auth.sign_up.return_value = mock_auth_response_for_service
     mock_auth.sign_in_with_password.return_value = mock_auth_response_for_service
 
-    mock_user_response_obj = MagicMock()
-    mock_user_response_obj.user = MagicMock()
-    mock_user_response_obj.user.model_dump.return_value = {
-        "id": "user123", "email": "test@example.com"}
+    mock_user_response_obj = Mock()
+    mock_user_response_obj.user = Mock()
+    mock_user_response_obj.user.model_dump.return_value = USER_PAYLOAD
     mock_auth.get_user.return_value = mock_user_response_obj
 
-    service._supabase_client.auth = mock_auth
+    service = SupabaseService()
+    # Rather than awaiting `initialize`, set `_supabase_client` directly to a plain
+    # `Mock` for precise control. The service only ever reaches `client.auth`.
+    service._supabase_client = Mock(auth=mock_auth)
 
-    yield service
+    # Without a JWT secret, HS256 tokens are validated remotely through Supabase Auth
+    with patch('src.services.supabase.SUPABASE_JWT_SECRET', None):
+        yield service
 
 
-@pytest.mark.asyncio
-async def test_sign_up_success(mock_supabase_service_for_methods: SupabaseService):
+@pytest.fixture(autouse=True)
+def reset_service_method_mocks(mock_supabase_service_for_methods):
+    """
+    Clears the calls and side effects configured by the previous test, keeping the auth
+    responses wired by the module-scoped fixture, and empties the token cache so tokens
+    validated by earlier tests are not served from it.
+    """
+    _token_cache.clear()
     mock_auth = mock_supabase_service_for_methods.client.auth
-    response = await mock_supabase_service_for_methods.sign_up("test@example.com", "password123")
-    mock_auth.sign_up.assert_called_once_with({
-        "email": "test@example.com",
-        "password": "password123"
-    })
-    assert response["user"]["email"] == "test@example.com"
-    assert response["session"]["access_token"] == "abc"
+    for mock in (mock_auth.sign_up, mock_auth.sign_in_with_password, mock_auth.get_user):
+        mock.reset_mock(side_effect=True)
 
 
 @pytest.mark.asyncio
-async def test_sign_up_auth_api_error(mock_supabase_service_for_methods: SupabaseService):
+async def test_sign_up_success(mock_supabase_service_for_methods: SupabaseService):
     mock_auth = mock_supabase_service_for_methods.client.auth
-    mock_auth.sign_up.side_effect = AuthApiError(
-        message="Duplicate user", status=400, code="400")
-    with pytest.raises(AuthApiError, match="Duplicate user"):
-        await mock_supabase_service_for_methods.sign_up("test@example.com", "password123")
-    mock_auth.sign_up.assert_called_once()
+    response = await mock_supabase_service_for_methods.sign_up(CREDENTIALS["email"], CREDENTIALS["password"])
+    mock_auth.sign_up.assert_called_once_with(CREDENTIALS)
+    assert response["user"]["email"] == "test@example.com"
+    assert response["session"]["access_token"] == "abc"
 
 
 @pytest.mark.asyncio
 async def test_sign_in_success(mock_supabase_service_for_methods: SupabaseService):
     mock_auth = mock_supabase_service_for_methods.client.auth
-    response = await mock_supabase_service_for_methods.sign_in("test@example.com", "password123")
-    mock_auth.sign_in_with_password.assert_called_once_with({
-        "email": "test@example.com",
-        "password": "password123"
-    })
+    response = await mock_supabase_service_for_methods.sign_in(CREDENTIALS["email"], CREDENTIALS["password"])
+    mock_auth.sign_in_with_password.assert_called_once_with(CREDENTIALS)
     assert response["user"]["email"] == "test@example.com"
     assert response["session"]["access_token"] == "abc"
 
 
 @pytest.mark.asyncio
-async def test_sign_in_auth_api_error(mock_supabase_service_for_methods: SupabaseService):
-    mock_auth = mock_supabase_service_for_methods.client.auth
-    mock_auth.sign_in_with_password.side_effect = AuthApiError(
-        message="Invalid credentials", status=400, code="400")
-    with pytest.raises(AuthApiError, match="Invalid credentials"):
-        await mock_supabase_service_for_methods.sign_in("test@example.com", "wrongpassword")
-    mock_auth.sign_in_with_password.assert_called_once()
+@pytest.mark.parametrize("method_name,auth_method_name,error", [
+    ("sign_up", "sign_up", DUPLICATE_USER_ERROR),
+    ("sign_in", "sign_in_with_password", INVALID_CREDENTIALS_ERROR),
+])
+async def test_auth_api_error(mock_supabase_service_for_methods: SupabaseService, method_name, auth_method_name, error):
+    auth_method = getattr(mock_supabase_service_for_methods.client.auth, auth_method_name)
+    auth_method.side_effect = error
+    with pytest.raises(AuthApiError, match=error.message):
+        await getattr(mock_supabase_service_for_methods, method_name)(CREDENTIALS["email"], CREDENTIALS["password"])
+    auth_method.assert_called_once()
 
 
 @pytest.mark.asyncio
 async def test_get_user_by_token_success(mock_supabase_service_for_methods: SupabaseService):
     mock_auth = mock_supabase_service_for_methods.client.auth
-    user_data = await mock_supabase_service_for_methods.get_user_by_token("valid_jwt")
-    mock_auth.get_user.assert_called_once_with("valid_jwt")
+    user_data = await mock_supabase_service_for_methods.get_user_by_token(VALID_JWT)
+    mock_auth.get_user.assert_called_once_with(VALID_JWT)
     assert user_data["id"] == "user123"
     assert user_data["email"] == "test@example.com"
 
 
 @pytest.mark.asyncio
-async def test_get_user_by_token_invalid(mock_supabase_service_for_methods: SupabaseService):
+@pytest.mark.parametrize("token,error", [
+    (INVALID_JWT, INVALID_JWT_ERROR),
+    (SOME_JWT, Exception("Network error")),
+])
+async def test_get_user_by_token_remote_failure(mock_supabase_service_for_methods: SupabaseService, token, error):
     mock_auth = mock_supabase_service_for_methods.client.auth
-    mock_auth.get_user.side_effect = AuthApiError(
-        message="Invalid JWT", status=401, code="401")
-    user_data = await mock_supabase_service_for_methods.get_user_by_token("invalid_jwt")
-    mock_auth.get_user.assert_called_once_with("invalid_jwt")
+    mock_auth.get_user.side_effect = error
+    user_data = await mock_supabase_service_for_methods.get_user_by_token(token)
+    mock_auth.get_user.assert_called_once_with(token)
     assert user_data is None
 
 
 @pytest.mark.asyncio
-async def test_get_user_by_token_unexpected_error(mock_supabase_service_for_methods: SupabaseService):
+async def test_get_user_by_token_cached(mock_supabase_service_for_methods: SupabaseService):
     mock_auth = mock_supabase_service_for_methods.client.auth
-    mock_auth.get_user.side_effect = Exception("Network error")
-    user_data = await mock_supabase_service_for_methods.get_user_by_token("some_jwt")
-    mock_auth.get_user.assert_called_once_with("some_jwt")
-    assert user_data is None
+    first = await mock_supabase_service_for_methods.get_user_by_token(VALID_JWT)
+    second = await mock_supabase_service_for_methods.get_user_by_token(VALID_JWT)
+    mock_auth.get_user.assert_called_once_with(VALID_JWT)
+    assert first == second
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_failure_not_cached(mock_supabase_service_for_methods: SupabaseService):
+    mock_auth = mock_supabase_service_for_methods.client.auth
+    mock_auth.get_user.side_effect = INVALID_JWT_ERROR
+    assert await mock_supabase_service_for_methods.get_user_by_token(INVALID_JWT) is None
+    assert await mock_supabase_service_for_methods.get_user_by_token(INVALID_JWT) is None
+    assert mock_auth.get_user.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_verified_locally(mock_supabase_service_for_methods: SupabaseService, mocker):
+    mocker.patch('src.services.supabase.SUPABASE_JWT_SECRET', TEST_JWT_SECRET)
+    mock_auth = mock_supabase_service_for_methods.client.auth
+    token = make_token(sub="local_user", secret=TEST_JWT_SECRET)
+    user_data = await mock_supabase_service_for_methods.get_user_by_token(token)
+    mock_auth.get_user.assert_not_called()
+    assert user_data["id"] == "local_user"
+    assert user_data["email"] == "test@example.com"
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_expired_rejected_locally(mock_supabase_service_for_methods: SupabaseService, mocker):
+    mocker.patch('src.services.supabase.SUPABASE_JWT_SECRET', TEST_JWT_SECRET)
+    mock_auth = mock_supabase_service_for_methods.client.auth
+    token = make_token(secret=TEST_JWT_SECRET, exp=int(time.time()) - 60)
+    assert await mock_supabase_service_for_methods.get_user_by_token(token) is None
+    mock_auth.get_user.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_concurrent_validations_deduplicated(mock_supabase_service_for_methods: SupabaseService):
+    mock_auth = mock_supabase_service_for_methods.client.auth
+    results = await asyncio.gather(
+        *(mock_supabase_service_for_methods.get_user_by_token(VALID_JWT) for _ in range(5)))
+    mock_auth.get_user.assert_called_once_with(VALID_JWT)
+    assert all(user_data == USER_PAYLOAD for user_data in results)
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_first_caller_cancelled(mock_supabase_service_for_methods: SupabaseService):
+    mock_auth = mock_supabase_service_for_methods.client.auth
+    release = asyncio.Event()
+    user_response = mock_auth.get_user.return_value
+
+    async def slow_get_user(token):
+        await release.wait()
+        return user_response
+
+    mock_auth.get_user.side_effect = slow_get_user
+    first = asyncio.ensure_future(mock_supabase_service_for_methods.get_user_by_token(VALID_JWT))
+    second = asyncio.ensure_future(mock_supabase_service_for_methods.get_user_by_token(VALID_JWT))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+
+    assert await asyncio.wait_for(second, timeout=1) == USER_PAYLOAD
+    assert first.cancelled()
+    mock_auth.get_user.assert_called_once_with(VALID_JWT)
+
+
+def test_token_cache_ttl_capped_by_expiry():
+    assert _token_cache_ttl(make_token(exp=int(time.time()) + 5)) <= 5
+    assert _token_cache_ttl(make_token()) == TOKEN_CACHE_TTL_SECONDS
+
+
+@pytest_asyncio.fixture
+async def jwks_signing_key(mock_supabase_service_for_methods: SupabaseService, mocker):
+    """
+    Serves a generated ES256 public key from a mocked JWKS endpoint through the
+    service's HTTP client, starting from an empty key cache. Yields the private
+    key and the list of JWKS requests made.
+    """
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    jwk = orjson.loads(ECAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update(kid="test-kid", alg="ES256", use="sig")
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"keys": [jwk]})
+
+    mocker.patch('src.services.supabase._jwks_keys', {})
+    mocker.patch('src.services.supabase._jwks_fetched_at', None)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http_client:
+        mocker.patch.object(mock_supabase_service_for_methods, '_http_client', http_client)
+        yield private_key, requests
+
+
+def make_es256_token(private_key, kid: str = "test-kid", sub: str = "jwks_user") -> str:
+    payload = {"sub": sub, "aud": "authenticated", "email": "test@example.com",
+               "exp": int(time.time()) + 3600}
+    return jwt.encode(payload, private_key, algorithm="ES256", headers={"kid": kid})
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_verified_with_jwks(mock_supabase_service_for_methods: SupabaseService, jwks_signing_key):
+    private_key, requests = jwks_signing_key
+    mock_auth = mock_supabase_service_for_methods.client.auth
+    user_data = await mock_supabase_service_for_methods.get_user_by_token(make_es256_token(private_key))
+    assert user_data["id"] == "jwks_user"
+    assert requests[0].url == "http://test_supabase.url/auth/v1/.well-known/jwks.json"
+
+    # Further tokens signed with the same key reuse the fetched key set
+    await mock_supabase_service_for_methods.get_user_by_token(make_es256_token(private_key, sub="other"))
+    assert len(requests) == 1
+    mock_auth.get_user.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_token_unknown_kid_refetch_rate_limited(mock_supabase_service_for_methods: SupabaseService, jwks_signing_key):
+    private_key, requests = jwks_signing_key
+    mock_auth = mock_supabase_service_for_methods.client.auth
+    await mock_supabase_service_for_methods.get_user_by_token(make_es256_token(private_key))
+
+    # Unknown keys fall back to Supabase Auth without refetching the key set each time
+    for sub in ("first", "second"):
+        await mock_supabase_service_for_methods.get_user_by_token(
+            make_es256_token(private_key, kid="rotated-kid", sub=sub))
+    assert len(requests) == 1
+    assert mock_auth.get_user.call_count == 2